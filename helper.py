@@ -1,10 +1,32 @@
+from __future__ import annotations
+
 import os
+import re
 import shutil
-from glob import glob
-from numpy import genfromtxt, ndarray
-import matplotlib.pyplot as plt
-from ltspice import Ltspice
-from typing import Tuple, List, Union
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from numpy import absolute, add, arange, array, concatenate, diff, dtype, empty, float64, fromstring, load, loadtxt, \
+    ndarray, save as save_npy, savez, stack, zeros
+from typing import TYPE_CHECKING, Tuple, List, Union
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
+    from matplotlib.axes import Axes
+    from ltspice import Ltspice
+
+_EXERCISE_PART_PATTERN = re.compile(r"E\d+P\d+$")
+_PLOT_MAX_POINTS = 50000
+_PLOT_DOWNSAMPLED_POINTS = 2000
+_SCOPE_HEADER_ROWS = 18
+
+# Parsed Ltspice state stored in the "<filepath>.npz" cache by load_simulation
+_SIM_CACHE_ARRAYS = ("x_raw", "y_raw")
+_SIM_CACHE_DTYPES = ("_x_dtype", "_y_dtype")
+_SIM_CACHE_STATE = _SIM_CACHE_ARRAYS + ("_case_split_point", "_variables", "_types", "_mode", "_file_type",
+                                        "_encoding", "_point_num", "_variable_num", "header_size", "dsamp", "tags",
+                                        "title", "date", "plot_name", "flags", "offset")
+_SIM_CACHE_REQUIRED = _SIM_CACHE_ARRAYS + _SIM_CACHE_DTYPES + ("_case_split_point", "_variables", "_mode")
 
 
 def get_scope_data(filename: str) -> Tuple[ndarray, ndarray]:
@@ -14,6 +36,10 @@ def get_scope_data(filename: str) -> Tuple[ndarray, ndarray]:
         SETTING, SETTING_VALUE, EMPTY, TIME, VOLTAGE
     This function is only interested in grabbing the 3rd and 4th column, the time and voltage column.
 
+    The parsed data is cached next to the CSV file as "<filename>.npy", so later calls can load it instead of parsing
+    the CSV again. The cache is ignored (and rewritten) if the CSV file has been modified since it was written or if it
+    can't be read. Either way, the returned arrays are regular writable ndarrays.
+
     Args:
         filename: string to the CSV file with the oscilloscope sample data
 
@@ -22,13 +48,115 @@ def get_scope_data(filename: str) -> Tuple[ndarray, ndarray]:
         voltage: ndarray containing the voltage values from the oscilloscope sample
 
     """
-    arr = genfromtxt(filename, delimiter=",")
-    return arr[:, 3], arr[:, 4]
+    cache = os.fspath(filename) + ".npy"
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(filename):
+        try:
+            arr = load(cache)
+            return arr[0], arr[1]
+        except (OSError, EOFError, ValueError, IndexError):
+            pass
+
+    try:
+        time, voltage = _parse_scope_csv(filename)
+    except ValueError:
+        time, voltage = loadtxt(filename, delimiter=",", usecols=(3, 4), unpack=True)
+    try:
+        save_npy(cache, stack([time, voltage]))
+    except OSError:
+        pass
+    return time, voltage
+
+
+def _parse_scope_csv(filename: str) -> Tuple[ndarray, ndarray]:
+    """
+    Fast path for get_scope_data. The first 18 rows of a Tektronix CSV are the setting rows (some of them blank), every
+    row after them looks like:
+        ,,,TIME,VOLTAGE,
+    so those rows are stripped down to their numbers and parsed in one go with numpy.fromstring, and only the setting
+    rows are split in Python.
+    Args:
+        filename: string to the CSV file with the oscilloscope sample data
+
+    Returns: (time, voltage)
+        time: ndarray containing the time values from the oscilloscope sample
+        voltage: ndarray containing the voltage values from the oscilloscope sample
+
+    Raises:
+        ValueError: if the file doesn't have the expected layout
+
+    """
+    with open(filename, "rb") as f:
+        data = f.read().replace(b"\r", b"")
+
+    lines = data.split(b"\n", _SCOPE_HEADER_ROWS)
+    if len(lines) <= _SCOPE_HEADER_ROWS or not lines[-1].strip(b"\n"):
+        raise ValueError(f"{filename} has no sample rows!")
+    header = array([line.split(b",")[3:5] for line in lines[:-1]], dtype=float64)
+
+    samples = lines[-1].rstrip(b"\n")
+    num_samples = samples.count(b"\n") + 1
+    if samples.count(b"\n,,,") + samples.startswith(b",,,") != num_samples:
+        raise ValueError(f"{filename} has malformed sample rows!")
+    samples = samples.replace(b",,,", b"").replace(b",\n", b"\n").replace(b"\n", b",").rstrip(b",")
+    values = fromstring(samples, sep=",")
+    if values.size != 2 * num_samples:
+        raise ValueError(f"{filename} has malformed sample rows!")
+
+    arr = concatenate([header, values.reshape(-1, 2)])
+    return arr[:, 0], arr[:, 1]
+
+
+def lttb_downsample(x: ndarray, y: ndarray, threshold: int) -> Tuple[ndarray, ndarray]:
+    """
+    Downsamples a waveform with the Largest-Triangle-Three-Buckets algorithm, which keeps the points that best preserve
+    the visual shape of the waveform. The first and last points are always kept, and every point in between is picked
+    from its own bucket as the one forming the largest triangle with the previously picked point and the average of the
+    next bucket.
+    Args:
+        x: ndarray with the x values, like time
+        y: ndarray with the y values, like voltage
+        threshold: number of points to keep
+
+    Returns: (x, y)
+        x: ndarray with the downsampled x values
+        y: ndarray with the downsampled y values
+
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    every = (n - 2) / (threshold - 2)
+    edges = (arange(threshold - 1) * every).astype(int) + 1
+    edges[-1] = n - 1
+
+    # The averages of the buckets (the last point counting as the final bucket) don't depend on the picked points, so
+    # they are all computed up front with one reduceat
+    counts = diff(concatenate([edges, [n]]))
+    avg_x = (add.reduceat(x, edges) / counts)[1:].tolist()
+    avg_y = (add.reduceat(y, edges) / counts)[1:].tolist()
+    edges = edges.tolist()
+
+    picked = zeros(threshold, dtype=int)
+    picked[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        xa, ya = float(x[a]), float(y[a])
+        # Twice the triangle area, expanded so the bucket's points are only touched by one multiply-add each
+        dx, dy = xa - avg_x[i], avg_y[i] - ya
+        area = absolute(dx * y[start:end] + dy * x[start:end] - (dx * ya + dy * xa))
+        a = start + int(area.argmax())
+        picked[i + 1] = a
+    return x[picked], y[picked]
 
 
 def plot_vi_vo(vi: ndarray, vo: ndarray, time: ndarray, save: str = None) -> plt:
     """
-    Quickly plots input and output voltage waveforms.
+    Quickly plots input and output voltage waveforms. Waveforms longer than 50000 points are downsampled to 2000 points
+    with lttb_downsample before plotting. When saving, the plot is drawn on its own Figure with the Agg canvas instead
+    of through pyplot, so it is safe to save plots from several threads at once, and pyplot never loads the default
+    (GUI) backend just to write a file.
     Args:
         vi: ndarray with input voltage data
         vo: ndarray with output voltage data
@@ -38,38 +166,154 @@ def plot_vi_vo(vi: ndarray, vo: ndarray, time: ndarray, save: str = None) -> plt
     Returns: the plot if it isn't saved
 
     """
-    plt.title("$v_i$ and $v_o$")
-    plt.plot(time, vi)
-    plt.plot(time, vo)
-    plt.legend(["$v_i$", "$v_o$"])
-    plt.xlabel("time (s)")
-    plt.ylabel("voltage (V)")
     if save:
-        plt.savefig(save)
-        plt.close()
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        _draw_vi_vo(fig.subplots(), vi, vo, time)
+        fig.savefig(save)
     else:
+        import matplotlib.pyplot as plt
+
+        _draw_vi_vo(plt.gca(), vi, vo, time)
         return plt
 
 
+def _draw_vi_vo(ax: Axes, vi: ndarray, vo: ndarray, time: ndarray):
+    """
+    Draws the input and output voltage waveforms for plot_vi_vo on the given axes
+    Args:
+        ax: Axes to draw on
+        vi: ndarray with input voltage data
+        vo: ndarray with output voltage data
+        time: ndarray with time data
+    """
+    ax.set_title("$v_i$ and $v_o$")
+    if len(time) > _PLOT_MAX_POINTS:
+        ax.plot(*lttb_downsample(time, vi, _PLOT_DOWNSAMPLED_POINTS))
+        ax.plot(*lttb_downsample(time, vo, _PLOT_DOWNSAMPLED_POINTS))
+    else:
+        ax.plot(time, vi)
+        ax.plot(time, vo)
+    ax.legend(["$v_i$", "$v_o$"])
+    ax.set_xlabel("time (s)")
+    ax.set_ylabel("voltage (V)")
+
+
+def load_simulation(filepath: str) -> Ltspice:
+    """
+    Loads an LTSpice simulation. The first time a ".RAW" file is loaded, it is parsed and the parsed state (the raw
+    data of every case and the header information) is cached next to it as "<filepath>.npz". Later loads rebuild the
+    Ltspice object from the cache instead of parsing the file again, unless the ".RAW" file has been modified since.
+    Either way the result is a regular Ltspice object, so every analysis mode and stepped run works the same.
+    Args:
+        filepath: filepath to the LTSpice ".RAW" file
+
+    Returns: the parsed Ltspice object
+
+    """
+    from ltspice import Ltspice
+
+    cache = filepath + ".npz"
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(filepath):
+        try:
+            return _load_cached_simulation(Ltspice, cache, filepath)
+        except (OSError, EOFError, KeyError, ValueError):
+            pass
+
+    sim = Ltspice(file_path=filepath)
+    sim.parse()
+    try:
+        savez(cache,
+              **{name: getattr(sim, name) for name in _SIM_CACHE_STATE if hasattr(sim, name)},
+              **{name: dtype(getattr(sim, name)).str for name in _SIM_CACHE_DTYPES})
+    except Exception:
+        # The cache is only an optimization, failing to write it should never fail the load
+        pass
+    return sim
+
+
+def _load_cached_simulation(ltspice_class: type, cache: str, filepath: str) -> Ltspice:
+    """
+    Rebuilds a parsed Ltspice object from a cache written by load_simulation, without reading the ".RAW" file
+    Args:
+        ltspice_class: the Ltspice class
+        cache: location of the ".npz" cache
+        filepath: filepath to the LTSpice ".RAW" file the cache belongs to
+
+    Returns: the parsed Ltspice object
+
+    Raises:
+        KeyError: if the cache is missing part of the parsed state
+
+    """
+    sim = ltspice_class.__new__(ltspice_class)
+    with load(cache) as data:
+        for name in _SIM_CACHE_REQUIRED:
+            if name not in data.files:
+                raise KeyError(cache + " is missing " + name)
+        for name in data.files:
+            if name in _SIM_CACHE_ARRAYS:
+                setattr(sim, name, data[name])
+            elif name in _SIM_CACHE_DTYPES:
+                setattr(sim, name, dtype(data[name].item()).type)
+            else:
+                setattr(sim, name, data[name].tolist())
+    sim.file_path = filepath
+    return sim
+
+
 class Exercise:
     """
     Base class for pre-lab simulations. Provides a quick and easy way to parse LTSpice data for our lab report use.
     """
     def __init__(self, filepath: Union[str, List[str]]) -> None:
         """
-        Instantiate an object with as many LTSpice readers as needed.
+        Instantiate an object with as many LTSpice readers as needed. The files are only loaded once sim is first used.
         Args:
             filepath: a single str or list of strings with filepaths to LTSpices' ".RAW" files
         """
-        if isinstance(filepath, str):
-            self.sim: Ltspice = Ltspice(file_path=filepath)
-            self.sim.parse()
-            self.size = -1
-        else:
-            self.sim: List[Ltspice] = [Ltspice(file_path=f) for f in filepath]
-            for sim in self.sim:
-                sim.parse()
-            self.size = len(self.sim)
+        self.filepath = filepath
+        self.size = -1 if isinstance(filepath, str) else len(filepath)
+
+    @cached_property
+    def sim(self) -> Union[Ltspice, List[Ltspice]]:
+        """
+        Returns: the loaded simulation, or a list of them if a list of filepaths was given
+        """
+        if isinstance(self.filepath, str):
+            return load_simulation(self.filepath)
+        return [load_simulation(f) for f in self.filepath]
+
+    def get_traces(self, name: str) -> ndarray:
+        """
+        Gathers a trace from every simulation into one contiguous array, so it can be worked on with vectorized numpy
+        operations (like a mean across simulations)
+        Args:
+            name: name of the trace, like "V(n001)"
+
+        Returns: ndarray of shape (number of simulations, trace length), with one row per simulation
+
+        Raises:
+            ValueError: if a simulation doesn't have the trace, or it doesn't have the same length in every simulation
+
+        """
+        sims = self.sim if isinstance(self.sim, list) else [self.sim]
+        first = sims[0].get_data(name)
+        if first is None:
+            raise ValueError(f"{name} not found in simulation 0")
+        traces = empty((len(sims), len(first)), dtype=first.dtype)
+        traces[0] = first
+        for row, sim in enumerate(sims[1:], start=1):
+            data = sim.get_data(name)
+            if data is None:
+                raise ValueError(f"{name} not found in simulation {row}")
+            if len(data) != len(first):
+                raise ValueError(f"{name} has {len(data)} points in simulation {row}, expected {len(first)}")
+            traces[row] = data
+        return traces
 
     def get_plot(self):
         """
@@ -99,17 +343,14 @@ class OscilloscopeDataCopier:
         """
         def __init__(self, location: str):
             """
-            Creates a File object based on the given location
+            Creates a File object based on the given location. The location isn't checked here, a missing file is
+            reported by save when it is copied
             Args:
                 location: location of where this file is
-            Raises:
-                FileNotFoundError: if the location of the file doesn't exist
             """
-            if os.path.exists(location):
-                self.location = location
-                self.name = os.path.basename(self.location)
-            else:
-                raise FileNotFoundError(location + " not found!")
+            self.location = location
+            self.location_b = os.fsencode(location)
+            self.name = os.path.basename(self.location)
 
         def save(self, destination: str, verbose: bool = True, softrun: bool = False):
             """
@@ -119,14 +360,28 @@ class OscilloscopeDataCopier:
                 verbose: whether to print out the moving dialog
                 softrun: whether to run the code without actually moving files
             """
-            if not os.path.exists(destination):
-                raise FileNotFoundError(destination + " not found!")
-
             if verbose or softrun:
-                print(f"\t{self.location} -> {os.path.join(destination, self.name)}")
+                print(self.describe(destination))
 
             if not softrun:
-                shutil.copy(self.location, os.path.join(destination, self.name))
+                self.copy(os.path.join(destination, self.name))
+
+        def describe(self, destination: str) -> str:
+            """
+            Args:
+                destination: where the file is saved to
+
+            Returns: the moving dialog line for saving this file to the destination
+            """
+            return f"\t{self.location} -> {os.path.join(destination, self.name)}"
+
+        def copy(self, target: str):
+            """
+            Copies the file's contents to the target path
+            Args:
+                target: path to copy the file to
+            """
+            shutil.copyfile(self.location_b, os.fsencode(target))
 
         def __str__(self) -> str:
             """
@@ -151,7 +406,7 @@ class OscilloscopeDataCopier:
             """
             super().__init__(location)
             if rename:
-                self.name = (str(self.location).split("/")[-2] + "." + self.name[-7:]).lower()
+                self.name = f"{os.path.basename(os.path.dirname(self.location))}.{self.name[-7:]}".lower()
 
     class JPGFile(File):
         """
@@ -167,7 +422,7 @@ class OscilloscopeDataCopier:
                 location: location of this file
             """
             super().__init__(location)
-            self.name = str(self.location).split("/")[-2].lower() + ".jpg"
+            self.name = f"{os.path.basename(os.path.dirname(self.location))}.jpg".lower()
 
     def __init__(self, drive_name: str = "ECE65-DATA"):
         """
@@ -182,7 +437,9 @@ class OscilloscopeDataCopier:
         if not os.path.exists(self.drive_location):
             raise FileNotFoundError("There is no drive named " + drive_name)
 
-        self.exercise_parts = glob(os.path.join(self.drive_location, "E*P*"))
+        with os.scandir(self.drive_location) as entries:
+            self.exercise_parts = [entry.path for entry in entries
+                                   if entry.is_dir(follow_symlinks=False) and _EXERCISE_PART_PATTERN.match(entry.name)]
         if not len(self.exercise_parts):
             print("[WARN]: No folders matching E<N>P<M>!")
 
@@ -207,31 +464,92 @@ class OscilloscopeDataCopier:
         if not os.path.exists(destination):
             raise FileNotFoundError()
 
+        jpg_path = os.path.join(destination, "jpgs")
+        if save_jpg:
+            os.makedirs(jpg_path, exist_ok=True)
+
+        jpgs_to_save, csvs_to_save = [], []
+        for exercise_part in self.exercise_parts:
+            jpg_files, csv_files = self._find_files(exercise_part, ".JPG", ".CSV")
+            if save_jpg:
+                jpgs_to_save.append((self.JPGFile(jpg_files[0]), jpg_path))
+            to_save_path = os.path.join(destination, os.path.basename(exercise_part)) if create_folders else destination
+            if create_folders:
+                os.makedirs(to_save_path, exist_ok=True)
+            csvs_to_save.extend((self.CSVFile(csv_file, rename_csv), to_save_path) for csv_file in csv_files)
+
         if save_jpg:
             if verbose:
                 print("\tSaving JPG Files...")
-            to_save_path = os.path.join(destination, "jpgs")
-            if not os.path.exists(to_save_path):
-                os.makedirs(to_save_path)
-            for exercise_part in self.exercise_parts:
-                self.JPGFile(glob(os.path.join(exercise_part, "*.JPG"))[0]) \
-                    .save(to_save_path, verbose=verbose, softrun=softrun)
+            self._save_files(jpgs_to_save, verbose=verbose, softrun=softrun)
             if softrun:
-                os.rmdir(to_save_path)
+                os.rmdir(jpg_path)
             print()
 
         if verbose:
             print("\tSaving CSV Files...")
-        for exercise_part in self.exercise_parts:
-            to_save_path = os.path.join(destination, os.path.basename(exercise_part)) if create_folders else destination
-            if create_folders and not os.path.exists(to_save_path):
-                os.makedirs(to_save_path)
-            for csv_file in glob(os.path.join(exercise_part, "*.CSV")):
-                self.CSVFile(csv_file, rename_csv) \
-                    .save(to_save_path, verbose=verbose, softrun=softrun)
-            if softrun and create_folders:
-                os.rmdir(to_save_path)
+        self._save_files(csvs_to_save, verbose=verbose, softrun=softrun)
+        if softrun and create_folders:
+            for exercise_part in self.exercise_parts:
+                os.rmdir(os.path.join(destination, os.path.basename(exercise_part)))
+
+    @staticmethod
+    def _find_files(directory: str, *extensions: str) -> List[List[str]]:
+        """
+        Finds the files in a directory with each of the given extensions, in a single pass over the directory. Hidden
+        files (like the "._" files macOS leaves on flash drives) are skipped
+        Args:
+            directory: directory to search in
+            extensions: extensions of the files to find, like ".CSV"
+
+        Returns: a list of paths to the matching files for each extension, in the same order as extensions
+
+        """
+        found = [[] for _ in extensions]
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                for files, extension in zip(found, extensions):
+                    if entry.name.endswith(extension):
+                        files.append(entry.path)
+        return found
+
+    @staticmethod
+    def _save_files(to_save: List[Tuple[File, str]], verbose: bool = True, softrun: bool = False):
+        """
+        Saves a batch of files to their destinations. The moving dialog for the whole batch is written to stdout at
+        once, and the copies are I/O bound, so they are spread over a thread pool.
+        Args:
+            to_save: list of (file, destination) pairs to save
+            verbose: whether to print out the moving dialog
+            softrun: whether to only print the moving dialog without actually moving files
+        """
+        if (verbose or softrun) and to_save:
+            sys.stdout.write("".join(file.describe(to_save_path) + "\n" for file, to_save_path in to_save))
+        if softrun:
+            return
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda pair: pair[0].save(pair[1], verbose=False), to_save))
 
 
 if __name__ == '__main__':
-    pass
+    # Check that the get_scope_data fast path handles the real TDS 1012C-EDU layout, including its blank setting rows
+    import tempfile
+
+    settings = ["Record Length,2.500000e+03", "Sample Interval,4.000000e-06", "Trigger Point,1.250000000000e+03",
+                ",", ",", ",", "Source,CH1", "Vertical Units,V", "Vertical Scale,5.000000e-01",
+                "Vertical Offset,0.000000e+00", "Horizontal Units,s", "Horizontal Scale,1.000000e-03", "Pt Fmt,Y",
+                "Yzero,0.000000e+00", "Probe Atten,1.000000e+01", "Model Number,TDS1012C-EDU",
+                "Serial Number,C000000", "Firmware Version,FV:v24.26"]
+    with tempfile.TemporaryDirectory() as directory:
+        sample = os.path.join(directory, "sample.csv")
+        with open(sample, "w", newline="") as f:
+            for i in range(2500):
+                setting = settings[i] if i < len(settings) else ","
+                f.write(f"{setting},,{(i - 1250) * 4e-6:.9f},{(i % 50) * 0.04:.5f},\r\n")
+        fast_time, fast_voltage = _parse_scope_csv(sample)
+        slow_time, slow_voltage = loadtxt(sample, delimiter=",", usecols=(3, 4), unpack=True)
+        assert (fast_time == slow_time).all() and (fast_voltage == slow_voltage).all()
+    print("get_scope_data fast path OK")
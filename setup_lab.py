@@ -1,6 +1,43 @@
 import os
+import json
 import argparse
-from helper import OscilloscopeDataCopier
+
+
+def new_markdown_cell(source: str) -> dict:
+    """
+    Creates a notebook markdown cell
+    Args:
+        source: markdown in the cell
+
+    Returns: dict of the cell in the nbformat v4 schema
+
+    """
+    return {"cell_type": "markdown", "metadata": {}, "source": source}
+
+
+def new_code_cell(source: str) -> dict:
+    """
+    Creates a notebook code cell
+    Args:
+        source: code in the cell
+
+    Returns: dict of the cell in the nbformat v4 schema
+
+    """
+    return {"cell_type": "code", "metadata": {}, "source": source, "outputs": [], "execution_count": None}
+
+
+def write_notebook(cells: list, path: str):
+    """
+    Writes a notebook with the given cells as nbformat v4 JSON
+    Args:
+        cells: list of cells from new_markdown_cell and new_code_cell
+        path: location to save the notebook to
+    """
+    notebook = {"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 4}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(notebook, f, indent=1, ensure_ascii=False)
+        f.write("\n")
 
 
 parser = argparse.ArgumentParser(prog="Lab Setup",
@@ -39,6 +76,8 @@ if prelab_only and copy_only:
     parser.error("Can't copy and not copy data from the flash drive")
 
 if copy_only:
+    from helper import OscilloscopeDataCopier
+
     print("Copying data from oscilloscope...")
     OscilloscopeDataCopier(drive_name=drive_name).copy_scope_data(copy_only, verbose=verbose)
 else:
@@ -46,40 +85,43 @@ else:
     lab_name = f"Lab {lab_number}"
     lab_dir = os.path.join(os.getcwd(), lab_name)
 
-    if not os.path.exists(lab_dir):
+    try:
+        os.makedirs(lab_dir)
         if verbose:
             print(f"Creating lab directory: {lab_dir}")
-        os.makedirs(lab_dir)
-    elif verbose:
-        print(f"Lab directory already found at: {lab_dir}")
+    except FileExistsError:
+        if verbose:
+            print(f"Lab directory already found at: {lab_dir}")
 
     for dir_type in ['assets', 'prelab', 'scope']:
         dir_to_add = os.path.join(lab_dir, dir_type)
-        if not os.path.exists(dir_to_add):
+        try:
+            os.makedirs(dir_to_add)
             if verbose:
                 print(f"Creating '{dir_type}' in {lab_name}: {dir_to_add}")
-            os.makedirs(dir_to_add)
-        elif verbose:
-            print(f"'{dir_type}' already found in {lab_name}: {dir_to_add}")
+        except FileExistsError:
+            if verbose:
+                print(f"'{dir_type}' already found in {lab_name}: {dir_to_add}")
 
     if num_exercises > 0:
         for i in range(1, num_exercises + 1):
             dir_to_add = os.path.join(lab_dir, 'prelab', f'exp{i}')
-            if not os.path.exists(dir_to_add):
+            try:
+                os.makedirs(dir_to_add)
                 if verbose:
                     print(f"Creating 'exp{i}' in 'prelab' of {lab_name}: {dir_to_add}")
-                os.makedirs(dir_to_add)
-            elif verbose:
-                print(f"'exp{i}' already found in 'prelab' of {lab_name}: {dir_to_add}")
+            except FileExistsError:
+                if verbose:
+                    print(f"'exp{i}' already found in 'prelab' of {lab_name}: {dir_to_add}")
 
     if not prelab_only:
+        from helper import OscilloscopeDataCopier
+
         print("Copying data from oscilloscope...")
         OscilloscopeDataCopier(drive_name=drive_name) \
             .copy_scope_data(os.path.join(lab_dir, 'scope'), verbose=verbose)
 
     if gen_notebooks:
-        import nbformat as nbf
-
         name_string = ""
         for idx, (n, i) in enumerate(zip(student_names, student_ids)):
             suffix = ""
@@ -90,14 +132,13 @@ else:
 
             name_string += f"{n} ({i})" + suffix
 
-        prelab = nbf.v4.new_notebook()
         prelab_cells = [
-            nbf.v4.new_markdown_cell(
+            new_markdown_cell(
                 f"# ECE 65 - Components and Circuits Lab\n"
                 f"## PreLab {lab_number}:\n" +
                 name_string
             ),
-            nbf.v4.new_code_cell(
+            new_code_cell(
                 f"import os\n"
                 f"import numpy as np\n"
                 f"from glob import glob\n"
@@ -112,13 +153,13 @@ else:
         ]
         if num_exercises > 0:
             for i in range(1, num_exercises + 1):
-                prelab_cells.append(nbf.v4.new_markdown_cell(
+                prelab_cells.append(new_markdown_cell(
                     f"# Experiment {i}\n"
                     f"***Description***\n"
                     f"### Circuits for Simulation:\n"
                     f"![](assets/e{i}p1.png) \n"
                 ))
-                prelab_cells.append(nbf.v4.new_code_cell(
+                prelab_cells.append(new_code_cell(
                     f"class Exercise{i}(Exercise):\n"
                     f"    def __init__(self):\n"
                     f"        data_path = os.path.join(os.getcwd(), \"prelabs\", \"exp{i}\")\n"
@@ -127,15 +168,13 @@ else:
                     f"if __name__ == '__main__':\n"
                     f"    e{i} = Exercise{i}()\n"
                 ))
-        prelab['cells'] = prelab_cells
         if verbose:
             print(f"Generated prelab{lab_number}.ipynb")
-        nbf.write(prelab, os.path.join(lab_dir, f'prelab{lab_number}.ipynb'))
+        write_notebook(prelab_cells, os.path.join(lab_dir, f'prelab{lab_number}.ipynb'))
 
-        main_lab = nbf.v4.new_notebook()
         experiment_titles = [f'### - [Experiment {i}](#experiment-{i}):\n' for i in range(1, num_exercises + 1)]
         main_lab_cells = [
-            nbf.v4.new_markdown_cell(
+            new_markdown_cell(
                 f"# ECE 65 – Components and Circuits Lab\n"
                 f"## Lab Report {lab_number} - \n"
                 f"\n" +
@@ -143,18 +182,18 @@ else:
                 f"\n\n"
                 f"Professor Saharnaz Baghdadchi"
             ),
-            nbf.v4.new_markdown_cell(
+            new_markdown_cell(
                 f"# Table of Contents\n"
                 f"## [Abstract](#abstract)\n"
                 f"## Experimental Procedures and Results\n" +
                 ''.join(experiment_titles) +
                 f"## [Conclusion](#conclusion)\n"
             ),
-            nbf.v4.new_markdown_cell(
+            new_markdown_cell(
                 "# Abstract\n"
                 "This lab is...\n"
             ),
-            nbf.v4.new_code_cell(
+            new_code_cell(
                 f"import os\n"
                 f"import numpy as np\n"
                 f"import matplotlib.pyplot as plt\n"
@@ -164,7 +203,7 @@ else:
         ]
         if num_exercises > 0:
             for i in range(1, num_exercises + 1):
-                main_lab_cells.append(nbf.v4.new_markdown_cell(
+                main_lab_cells.append(new_markdown_cell(
                     f"# Experiment {i}\n"
                     f"***Description***\n\n"
                     f"## PreLab\n\n"
@@ -172,20 +211,17 @@ else:
                     f"![](assets/e{i}p1.png) \n\n"
                     f"### Simulation:\n\n"
                 ))
-                main_lab_cells.append(nbf.v4.new_code_cell(
+                main_lab_cells.append(new_code_cell(
                     f"prelab{lab_number}.Exercise{i}().part_1()\n"
                     f"plt.show()\n"
                 ))
-                main_lab_cells.append(nbf.v4.new_markdown_cell(
+                main_lab_cells.append(new_markdown_cell(
                     "## Lab Exercises:"
                 ))
-        main_lab_cells.append(nbf.v4.new_markdown_cell(
+        main_lab_cells.append(new_markdown_cell(
             "# Conclusion"
         ))
-        main_lab['cells'] = main_lab_cells
         if verbose:
             print(f"Generated Lab Report {lab_number}.ipynb")
-        if os.path.exists(os.path.join(lab_dir, f'Lab Report {lab_number}.ipynb')):
-            os.remove(os.path.join(lab_dir, f'Lab Report {lab_number}.ipynb'))
-        nbf.write(main_lab, os.path.join(lab_dir, f'Lab Report {lab_number}.ipynb'))
+        write_notebook(main_lab_cells, os.path.join(lab_dir, f'Lab Report {lab_number}.ipynb'))
 print("Done.")